@@ -0,0 +1,84 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Callable, Any
+
+
+"""
+Classe que coleta medições do simulador: tempo de cada fase (análise, expansão, execução, exibição), contadores
+(passos, macros expandidas, rótulos gerados por novo_rotulo...) e callbacks chamados a cada passo e a cada desvio
+de rodar_norma.
+As funções do simulador recebem a instrumentação como parâmetro opcional. Sem ela (None) nada é medido, e sem
+callbacks registrados o laço de execução de rodar_norma faz apenas um teste local por passo para cada tipo de gancho.
+"""
+class Instrumentacao:
+    def __init__(self):
+        self.origem = time.perf_counter()
+        self.fases: List[Tuple[str, float, float]] = []       # (nome, início, duração) em segundos desde a origem
+        self.contadores: Dict[str, int] = {}
+        self.ao_passo: List[Callable[[int, Dict, Dict[int, int]], Any]] = []
+        self.ao_desvio: List[Callable[[int, int, bool], Any]] = []
+
+    """
+    Registra uma função chamada antes de cada instrução executada, como f(rotulo, instrucao, registradores)
+    """
+    def registrar_passo(self, funcao: Callable[[int, Dict, Dict[int, int]], Any]):
+        self.ao_passo.append(funcao)
+
+    """
+    Registra uma função chamada a cada se_zero executado, como f(rotulo, destino, registrador_era_zero)
+    """
+    def registrar_desvio(self, funcao: Callable[[int, int, bool], Any]):
+        self.ao_desvio.append(funcao)
+
+    def incrementar(self, nome: str, quantidade: int = 1):
+        self.contadores[nome] = self.contadores.get(nome, 0) + quantidade
+
+    """
+    Mede o tempo do bloco 'with' e o guarda como uma fase com o nome dado
+    """
+    @contextmanager
+    def fase(self, nome: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            fim = time.perf_counter()
+            self.fases.append((nome, inicio - self.origem, fim - inicio))
+
+    """
+    Soma das durações de cada fase, em segundos
+    """
+    def tempos_por_fase(self) -> Dict[str, float]:
+        tempos = {}
+        for nome, _, duracao in self.fases:
+            tempos[nome] = tempos.get(nome, 0.0) + duracao
+        return tempos
+
+    def como_dict(self) -> Dict[str, Any]:
+        return {
+            'fases': [{'nome': nome, 'inicio_s': inicio, 'duracao_s': duracao} for nome, inicio, duracao in self.fases],
+            'tempos_por_fase_s': self.tempos_por_fase(),
+            'contadores': dict(self.contadores),
+        }
+
+    def exportar_json(self, caminho: str):
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(self.como_dict(), f, indent=2, ensure_ascii=False)
+
+    """
+    Exporta no formato de eventos do Chrome (abre em chrome://tracing ou no Perfetto): cada fase vira um evento
+    completo ('X') e os contadores um evento de contador ('C') no fim da linha do tempo.
+    """
+    def exportar_chrome_trace(self, caminho: str):
+        eventos = []
+        fim = 0.0
+        for nome, inicio, duracao in self.fases:
+            eventos.append({'name': nome, 'cat': 'fase', 'ph': 'X', 'pid': 1, 'tid': 1,
+                            'ts': inicio * 1e6, 'dur': duracao * 1e6})
+            fim = max(fim, inicio + duracao)
+        if self.contadores:
+            eventos.append({'name': 'contadores', 'ph': 'C', 'pid': 1, 'tid': 1, 'ts': fim * 1e6,
+                            'args': dict(self.contadores)})
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': eventos, 'displayTimeUnit': 'ms'}, f, indent=2, ensure_ascii=False)
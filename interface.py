@@ -1,8 +1,12 @@
+import os
 import tkinter as tk
+from contextlib import nullcontext
 from tkinter import filedialog, messagebox, scrolledtext, ttk
-from typing import Dict, Tuple
-from norma import analisar_texto_programa, rodar_norma, nome_para_indice_registrador
-from macro import ExpansorMacro
+from typing import Dict, Tuple, List, Optional
+from norma import analisar_linha_programa, rodar_norma, estados_do_traco, registradores_usados, \
+    nome_para_indice_registrador, indice_para_nome_registrador
+from macro import ExpansorMacro, ROTULOS_POR_MACRO, ARQUIVO_MODELOS_PADRAO, carregar_modelos
+from instrumentacao import Instrumentacao
 
 
 """
@@ -10,12 +14,17 @@ Classe que representa a interface gráfica do usuário (GUI) do compilador. Feit
 """
 class AppNorma:
 
+    ATRASO_RECOMPILACAO_MS = 300    # Espera após a última tecla antes de reanalisar o programa
+    # Expansões de macro geradas por superotimizador.py; se o arquivo existir, substituem as embutidas
+    ARQUIVO_MODELOS = ARQUIVO_MODELOS_PADRAO
+
     """
        Construtor da classe. Ele cria todos os elementos da interface (janelas, botões, caixas de texto) e define
        suas propriedades e posições
     """
-    def __init__(self, root):
+    def __init__(self, root, instrumentacao: Optional[Instrumentacao] = None):
         self.root = root
+        self.instrumentacao = instrumentacao    # Mede as fases análise, expansão, execução e exibição, se informada
         root.title("Simulador Máquina Norma")
         frm = tk.Frame(root)
         frm.pack(padx=8, pady=8, fill=tk.BOTH, expand=True)
@@ -55,6 +64,31 @@ class AppNorma:
 3: faça add_b vá_para 1
 """
         self.texto_programa.insert(tk.END, exemplo)
+        self.texto_programa.tag_configure('erro', background='#f8d7da')
+
+        self.rotulo_status = tk.Label(frame_esquerda, anchor='w', justify=tk.LEFT)
+        self.rotulo_status.pack(fill=tk.X)
+
+        self.modelos_macros = None
+        if os.path.exists(self.ARQUIVO_MODELOS):
+            try:
+                self.modelos_macros = carregar_modelos(self.ARQUIVO_MODELOS)
+            except Exception as e:
+                messagebox.showwarning("Modelos de macro", f"Usando as macros embutidas, '{self.ARQUIVO_MODELOS}' "
+                                                           f"é inválido: {e}")
+
+        # Estado da compilação incremental: cada linha analisada fica em cache pelo seu texto e cada expansão de
+        # macro pelo seu contexto, de modo que a cada edição só as linhas alteradas voltam a ser analisadas.
+        self.cache_linhas: Dict[str, Tuple] = {}
+        self.cache_expansoes: Dict[Tuple, List[Tuple[int, Dict]]] = {}
+        self.analisado: Dict[int, Tuple] = {}
+        self.erros_analise: List[Tuple[int, str]] = []
+        self.erro_expansao = ''
+        self.programa_compilado: Optional[Dict[int, Dict]] = None
+        self.id_recompilacao = None
+        self.texto_programa.edit_modified(False)
+        self.texto_programa.bind('<<Modified>>', self.ao_modificar_programa)
+        self.recompilar_programa()
 
         frame_direita = tk.Frame(corpo)
         corpo.add(frame_direita)
@@ -101,13 +135,16 @@ class AppNorma:
             "1. Configuração Inicial\n"
             "   • Defina o número de registradores (N)\n"
             "   • Informe os valores iniciais separados por vírgula\n"
-            "   • Exemplo: 3,5,0 para 3 registradores com valores a=3, b=5, c=0\n\n"
+            "   • Exemplo: 3,5,0 para 3 registradores com valores a=3, b=5, c=0\n"
+            "   • Também é possível nomear o registrador: r500=3, ab=2\n"
+            "   • Valores nomeados não contam na posição: em r5=3,7 o 7 vai para a\n\n"
 
             "2. Programação\n"
             "   • Escreva o programa no campo esquerdo\n"
             "   • Formato: rótulo: instrução\n"
             "   • Use instruções primitivas ou macros\n"
-            "   • Exemplo: 1: se_zero_a então vá_para 5 senão vá_para 2\n\n"
+            "   • Exemplo: 1: se_zero_a então vá_para 5 senão vá_para 2\n"
+            "   • Erros de sintaxe são destacados na própria linha enquanto você digita\n\n"
 
             "3. Execução\n"
             "   • Clique em 'Rodar' para iniciar a simulação\n"
@@ -117,6 +154,7 @@ class AppNorma:
             "4. Resultados\n"
             "   • Analise a saída completa no campo direito\n"
             "   • Cada linha mostra (rótulo atual, estado dos registradores)\n"
+            "   • Aparecem os registradores citados no programa ou com valor inicial, listados na primeira linha\n"
             "   • Identifique possíveis erros ou loops infinitos\n\n"
 
             "DICA: Você pode carregar programas salvos em arquivos .txt"
@@ -140,7 +178,10 @@ class AppNorma:
             "   • Comportamento: Subtrai 1 de X (se X > 0) e salta para o rótulo L\n"
             "   • Exemplo: 3: faça sub_c vá_para 4\n\n"
 
-            "OBS: Substitua X pelo registrador (a, b, c, ...) e L pelo rótulo desejado (1, 2, 3...)."
+            "OBS: Substitua X pelo registrador e L pelo rótulo desejado (1, 2, 3...).\n"
+            "Registradores: a..z, depois aa, ab, ... (como colunas de planilha), ou r0, r1, ..., r9999.\n"
+            "Na saída, registradores a partir de 26 aparecem com os dois nomes (ex.: aa/r26).\n"
+            "r0 é o mesmo que a, r25 o mesmo que z. N deve ser maior que o maior índice usado."
         )
 
         conteudo3 = (
@@ -164,7 +205,8 @@ class AppNorma:
             "   • Sintaxe: 1: MENOR a b c\n"
             "   • Funcionalidade: Armazena o menor valor entre a e b em c\n\n"
 
-            "OBS: As macros são traduzidas internamente em instruções primitivas."
+            "OBS: As macros são traduzidas internamente em instruções primitivas. Se existir o arquivo "
+            "modelos_macros.json (gerado por superotimizador.py), as traduções dele são usadas no lugar das embutidas."
         )
 
         criar_aba("Como usar", conteudo1)
@@ -185,96 +227,223 @@ class AppNorma:
         self.texto_programa.insert('1.0', conteudo)
 
     """
-    Converte código alto nível (com macros) em código que a máquina norma entende
+    Chamada pelo evento <<Modified>> do editor. Agenda a recompilação para depois que o usuário parar de digitar,
+    cancelando o agendamento anterior, para que cada tecla não dispare uma análise do programa inteiro.
+    """
+    def ao_modificar_programa(self, event=None):
+        if not self.texto_programa.edit_modified():
+            return
+        self.texto_programa.edit_modified(False)
+        if self.id_recompilacao is not None:
+            self.root.after_cancel(self.id_recompilacao)
+        self.id_recompilacao = self.root.after(self.ATRASO_RECOMPILACAO_MS, self.recompilar_programa)
+
+    """
+    Reanalisa o programa do editor usando o cache por linha: só as linhas cujo texto mudou passam de novo por 
+    analisar_linha_programa, e só as macros cujo contexto mudou são expandidas de novo. Os erros são marcados 
+    na própria linha e o programa expandido fica pronto em self.programa_compilado.
+    """
+    def recompilar_programa(self):
+        self.id_recompilacao = None
+        linhas = self.texto_programa.get('1.0', 'end-1c').splitlines()
+
+        cache_novo = {}
+        analisado = {}
+        erros = []
+        reanalisadas = 0
+        with self.instrumentacao.fase('analise') if self.instrumentacao is not None else nullcontext():
+            for num_linha, raw in enumerate(linhas, start=1):
+                resultado = cache_novo.get(raw)
+                if resultado is None:
+                    resultado = self.cache_linhas.get(raw)
+                    if resultado is None:
+                        reanalisadas += 1
+                        try:
+                            resultado = ('ok', analisar_linha_programa(raw))
+                        except ValueError as e:
+                            resultado = ('erro', str(e))
+                    cache_novo[raw] = resultado
+
+                if resultado[0] == 'erro':
+                    erros.append((num_linha, resultado[1]))
+                elif resultado[1] is not None:
+                    rotulo, no = resultado[1]
+                    analisado[rotulo] = no
+        if self.instrumentacao is not None:
+            self.instrumentacao.incrementar('linhas_analisadas', reanalisadas)
+        self.cache_linhas = cache_novo      # Descarta as linhas que não existem mais
+        self.analisado = analisado
+        self.erros_analise = erros
+
+        # Só expande as macros se a análise não encontrou erros
+        self.erro_expansao = ''
+        self.programa_compilado = None
+        if not erros:
+            try:
+                N = int(self.entrada_N.get().strip())
+            except ValueError:
+                N = 0
+            try:
+                self.programa_compilado = self.montar_programa_expandido(analisado, N, self.cache_expansoes)
+            except Exception as e:
+                self.erro_expansao = str(e)
+
+        self.mostrar_erros_analise()
+
+    """
+    Destaca as linhas com erro no editor e resume o estado da compilação abaixo dele
+    """
+    def mostrar_erros_analise(self):
+        self.texto_programa.tag_remove('erro', '1.0', tk.END)
+        for num_linha, _ in self.erros_analise:
+            self.texto_programa.tag_add('erro', f'{num_linha}.0', f'{num_linha}.end')
+
+        if self.erros_analise:
+            num_linha, msg = self.erros_analise[0]
+            texto = f"Linha {num_linha}: {msg}"
+            if len(self.erros_analise) > 1:
+                texto += f" (+{len(self.erros_analise) - 1} erro(s))"
+            self.rotulo_status.config(text=texto, fg='#c0392b')
+        elif self.erro_expansao:
+            self.rotulo_status.config(text=f"Erro ao expandir macros: {self.erro_expansao}", fg='#c0392b')
+        else:
+            self.rotulo_status.config(text=f"Programa OK ({len(self.analisado)} instruções)", fg='#27ae60')
+
+    """
+    Converte código alto nível (com macros) em código que a máquina norma entende.
+    Se um cache for informado, cada instrução primitiva e cada macro já expandida em uma chamada anterior é 
+    reaproveitada enquanto seu contexto (rótulo, instrução, rótulo de retorno e rótulos gerados) não mudar.
     """
-    def montar_programa_expandido(self, analisado: Dict[int, Tuple], N: int) -> Dict[int, Dict]:
-        expansor = ExpansorMacro(base_rotulo_inicio=100000)     # Rótulo inicial que a macro irá aparecer
+    def montar_programa_expandido(self, analisado: Dict[int, Tuple], N: int,
+                                  cache: Optional[Dict[Tuple, List[Tuple[int, Dict]]]] = None) -> Dict[int, Dict]:
+        with self.instrumentacao.fase('expansao') if self.instrumentacao is not None else nullcontext():
+            return self._montar_programa_expandido(analisado, N, cache)
+
+    def _montar_programa_expandido(self, analisado: Dict[int, Tuple], N: int,
+                                   cache: Optional[Dict[Tuple, List[Tuple[int, Dict]]]]) -> Dict[int, Dict]:
+        expansor = ExpansorMacro(base_rotulo_inicio=100000, modelos=self.modelos_macros,  # Rótulo inicial que a macro irá aparecer
+                                 instrumentacao=self.instrumentacao)
         programa_expandido = {}
         rotulos_orig = sorted(analisado.keys())
+        usados = {}
 
         for idx, rotulo in enumerate(rotulos_orig):
             no = analisado[rotulo]
 
             if no[0] != 'vazio' and not no[0].startswith('macro_'):
-                tipo = no[0]
-                if tipo == 'se_zero':
-                    programa_expandido[rotulo] = {
-                        'tipo': 'se_zero',
-                        'reg': nome_para_indice_registrador(no[1]),
-                        'entao': no[2],
-                        'senao': no[3]
-                    }
-                elif tipo == 'adicionar':
-                    programa_expandido[rotulo] = {
-                        'tipo': 'adicionar',
-                        'reg': nome_para_indice_registrador(no[1]),
-                        'ir_para': no[2]
-                    }
-                elif tipo == 'subtrair':
-                    programa_expandido[rotulo] = {
-                        'tipo': 'subtrair',
-                        'reg': nome_para_indice_registrador(no[1]),
-                        'ir_para': no[2]
-                    }
-                else:
-                    raise ValueError(f"Tipo pós-análise desconhecido: {no}")
+                chave = (rotulo, no)
+                bloco = cache.get(chave) if cache is not None else None
+                if bloco is None:
+                    bloco = [(rotulo, self.converter_primitiva(no))]
 
             elif no[0].startswith('macro_'):
-                bloco = expansor.expandir_macro(no, N)
-                rotulos_bloco = [rotulo] + [expansor.novo_rotulo() for _ in range(len(bloco) - 1)]
                 rotulo_seguinte = rotulos_orig[idx + 1] if (idx + 1) < len(rotulos_orig) else None
                 r_rotulo_retorno = rotulo_seguinte if rotulo_seguinte is not None else (rotulo + 1)
+                # Cada macro usa a faixa de rótulos do seu próprio rótulo, então a expansão guardada continua 
+                # válida mesmo que outras macros sejam incluídas ou removidas antes dela
+                chave = (rotulo, no, r_rotulo_retorno, N)
+                bloco = cache.get(chave) if cache is not None else None
+                if bloco is None:
+                    expansor.iniciar_faixa(rotulo)
+                    bloco = self.expandir_bloco_macro(expansor, no, N, rotulo, r_rotulo_retorno)
+            else:
+                continue
+
+            usados[chave] = bloco
+            programa_expandido.update(bloco)
+
+        if cache is not None:
+            cache.clear()
+            cache.update(usados)
+        return programa_expandido
 
-                for i, instr_rel in enumerate(bloco):
-                    instr = instr_rel.copy()
-
-                    if instr.get('tipo') == 'se_zero':
-                        ent_idx = instr.pop('entao_idx', None)
-                        sen_idx = instr.pop('senao_idx', None)
-
-                        def conv_index(v):
-                            if v == 'ret' or v is None:
-                                return r_rotulo_retorno
-                            if v == 'error_div0':
-                                return 99999998
-                            if isinstance(v, int):
-                                if 0 <= v < len(rotulos_bloco):
-                                    return rotulos_bloco[v]
-                                else:
-                                    return r_rotulo_retorno
-                            raise ValueError("índice desconhecido em se_zero: " + str(v))
-
-                        instr['entao'] = conv_index(ent_idx)
-                        instr['senao'] = conv_index(sen_idx)
-                        instr['tipo'] = 'se_zero'
-
-                    elif instr.get('tipo') in ('adicionar', 'subtrair'):
-                        if 'ir_idx' in instr:
-                            ir = instr.pop('ir_idx')
-                            if isinstance(ir, int):
-                                instr['ir_para'] = rotulos_bloco[ir] if 0 <= ir < len(
-                                    rotulos_bloco) else r_rotulo_retorno
-                            elif ir == 'ret' or ir is None:
-                                instr['ir_para'] = r_rotulo_retorno
-                            else:
-                                instr['ir_para'] = r_rotulo_retorno
-                        else:
-                            instr['ir_para'] = instr.get('ir_para', r_rotulo_retorno)
-                        instr['tipo'] = instr_rel['tipo']
+    """
+    Converte uma instrução primitiva analisada para o formato executado por rodar_norma
+    """
+    def converter_primitiva(self, no: Tuple) -> Dict:
+        tipo = no[0]
+        if tipo == 'se_zero':
+            return {
+                'tipo': 'se_zero',
+                'reg': nome_para_indice_registrador(no[1]),
+                'entao': no[2],
+                'senao': no[3]
+            }
+        elif tipo == 'adicionar':
+            return {
+                'tipo': 'adicionar',
+                'reg': nome_para_indice_registrador(no[1]),
+                'ir_para': no[2]
+            }
+        elif tipo == 'subtrair':
+            return {
+                'tipo': 'subtrair',
+                'reg': nome_para_indice_registrador(no[1]),
+                'ir_para': no[2]
+            }
+        raise ValueError(f"Tipo pós-análise desconhecido: {no}")
 
-                    elif instr.get('tipo') == 'ir_idx':
-                        ir = instr.pop('ir_idx')
-                        if isinstance(ir, int) and 0 <= ir < len(rotulos_bloco):
-                            instr = {'tipo': 'ir_para', 'ir_para': rotulos_bloco[ir]}
+    """
+    Expande a macro de um rótulo do programa, devolvendo a lista de pares (rótulo, instrução) que a substituem
+    """
+    def expandir_bloco_macro(self, expansor: ExpansorMacro, no: Tuple, N: int, rotulo: int,
+                             r_rotulo_retorno: int) -> List[Tuple[int, Dict]]:
+        bloco = expansor.expandir_macro(no, N)
+        if len(bloco) > ROTULOS_POR_MACRO:
+            raise ValueError(f"Expansão da macro no rótulo {rotulo} excede {ROTULOS_POR_MACRO} instruções")
+        rotulos_bloco = [rotulo] + [expansor.novo_rotulo() for _ in range(len(bloco) - 1)]
+        resultado = []
+
+        for i, instr_rel in enumerate(bloco):
+            instr = instr_rel.copy()
+
+            if instr.get('tipo') == 'se_zero':
+                ent_idx = instr.pop('entao_idx', None)
+                sen_idx = instr.pop('senao_idx', None)
+
+                def conv_index(v):
+                    if v == 'ret' or v is None:
+                        return r_rotulo_retorno
+                    if v == 'error_div0':
+                        return 99999998
+                    if isinstance(v, int):
+                        if 0 <= v < len(rotulos_bloco):
+                            return rotulos_bloco[v]
                         else:
-                            instr = {'tipo': 'ir_para', 'ir_para': r_rotulo_retorno}
+                            return r_rotulo_retorno
+                    raise ValueError("índice desconhecido em se_zero: " + str(v))
+
+                instr['entao'] = conv_index(ent_idx)
+                instr['senao'] = conv_index(sen_idx)
+                instr['tipo'] = 'se_zero'
+
+            elif instr.get('tipo') in ('adicionar', 'subtrair'):
+                if 'ir_idx' in instr:
+                    ir = instr.pop('ir_idx')
+                    if isinstance(ir, int):
+                        instr['ir_para'] = rotulos_bloco[ir] if 0 <= ir < len(
+                            rotulos_bloco) else r_rotulo_retorno
+                    elif ir == 'ret' or ir is None:
+                        instr['ir_para'] = r_rotulo_retorno
+                    else:
+                        instr['ir_para'] = r_rotulo_retorno
+                else:
+                    instr['ir_para'] = instr.get('ir_para', r_rotulo_retorno)
+                instr['tipo'] = instr_rel['tipo']
+
+            elif instr.get('tipo') == 'ir_idx':
+                ir = instr.pop('ir_idx')
+                if isinstance(ir, int) and 0 <= ir < len(rotulos_bloco):
+                    instr = {'tipo': 'ir_para', 'ir_para': rotulos_bloco[ir]}
+                else:
+                    instr = {'tipo': 'ir_para', 'ir_para': r_rotulo_retorno}
 
-                    elif instr.get('tipo') == 'ret':
-                        instr = {'tipo': 'ir_para', 'ir_para': r_rotulo_retorno}
+            elif instr.get('tipo') == 'ret':
+                instr = {'tipo': 'ir_para', 'ir_para': r_rotulo_retorno}
 
-                    programa_expandido[rotulos_bloco[i]] = instr
+            resultado.append((rotulos_bloco[i], instr))
 
-        return programa_expandido
+        return resultado
 
     """
     Coordena todo o processo: leitura --> compilação --> execução --> exibição
@@ -289,32 +458,46 @@ class AppNorma:
             messagebox.showerror("Erro", f"Valor de N inválido: {e}")
             return
 
+        # Os valores podem ser posicionais (3,0,...) ou nomeados (r500=3, ab=2); só os diferentes de zero são guardados.
+        # Os itens nomeados não contam na posição: em "r5=3,7" o 7 vai para a.
         str_init = self.entrada_init.get().strip()
+        vals_init = {}
         try:
-            vals_init = [int(x.strip()) for x in str_init.split(',') if x.strip() != '']
+            itens = [x.strip() for x in str_init.split(',') if x.strip() != '']
+            pos = 0
+            for item in itens:
+                if '=' in item:
+                    nome, valor = item.split('=', 1)
+                    reg = nome_para_indice_registrador(nome)
+                    if reg >= N:
+                        messagebox.showerror("Erro", f"Valores iniciais inválidos: registrador '{nome.strip()}' "
+                                                     f"(índice {reg}) não cabe em N={N}")
+                        return
+                else:
+                    reg, valor = pos, item
+                    pos += 1
+                if int(valor) < 0:
+                    messagebox.showerror("Erro", f"Valores iniciais inválidos: '{item}' é negativo (os registradores "
+                                                 f"da máquina Norma guardam números naturais)")
+                    return
+                if reg < N and int(valor) != 0:
+                    vals_init[reg] = int(valor)
         except:
             messagebox.showerror("Erro", "Valores iniciais inválidos")
             return
 
-        if len(vals_init) < N:
-            vals_init += [0] * (N - len(vals_init))
-        elif len(vals_init) > N:
-            vals_init = vals_init[:N]
-
-        # Chama analisar_texto_programa para converter o código digitado em um dicionário.
-        src = self.texto_programa.get('1.0', tk.END)
-        try:
-            analisado = analisar_texto_programa(src)
-        except Exception as e:
-            messagebox.showerror("Erro na análise", str(e))
+        # Atualiza a compilação incremental (só o que mudou desde a última edição é reprocessado).
+        if self.id_recompilacao is not None:
+            self.root.after_cancel(self.id_recompilacao)
+        self.recompilar_programa()
+        if self.erros_analise:
+            num_linha, msg = self.erros_analise[0]
+            messagebox.showerror("Erro na análise", f"Linha {num_linha}: {msg}")
             return
-
-        # Expande todas as macros no programa.
-        try:
-            programa_expandido = self.montar_programa_expandido(analisado, N)
-        except Exception as e:
-            messagebox.showerror("Erro ao expandir macros", str(e))
+        if self.erro_expansao:
+            messagebox.showerror("Erro ao expandir macros", self.erro_expansao)
             return
+        programa_expandido = self.programa_compilado
 
         if not programa_expandido:
             messagebox.showinfo("Execução", "Programa vazio.")
@@ -322,21 +505,28 @@ class AppNorma:
 
         # Chama rodar_norma para simular a execução do programa já expandido.
         rotulo_inicial = min(programa_expandido.keys())
-        regs = list(vals_init)
-        historico_execucao, erro = rodar_norma(programa_expandido, rotulo_inicial, regs, max_passos=100000)
+        regs = dict(vals_init)
+        historico_execucao, erro = rodar_norma(programa_expandido, rotulo_inicial, regs, max_passos=100000, num_regs=N,
+                                               instrumentacao=self.instrumentacao)
 
         # Formata o historico_execucao de execução para exibição e, se houver um erro, mostra uma mensagem de aviso.
-        self.texto_saida.delete('1.0', tk.END)
-        for passo in historico_execucao:
-            lbl, estado = passo
-            self.texto_saida.insert(tk.END, f"({lbl}, ({', '.join(str(x) for x in estado)}))\n")
+        # Só aparecem os registradores citados no programa ou alterados, para o custo não depender de N.
+        with self.instrumentacao.fase('exibicao') if self.instrumentacao is not None else nullcontext():
+            self.texto_saida.delete('1.0', tk.END)
+            usados = registradores_usados(programa_expandido, historico_execucao, vals_init)
+            linhas = [f"Registradores: ({', '.join(indice_para_nome_registrador(r) for r in usados)})"]
+            estados = list(estados_do_traco(historico_execucao, vals_init, usados))
+            for passo in estados:
+                lbl, estado = passo
+                linhas.append(f"({lbl}, ({', '.join(str(x) for x in estado)}))")
+            self.texto_saida.insert(tk.END, '\n'.join(linhas) + '\n')
 
         if erro:
             self.texto_saida.insert(tk.END, f"\nERRO: {erro}\n")
             messagebox.showwarning("Execução", "Execução terminou com erro (veja saída).")
         else:
-            if historico_execucao:
-                ultimo_lbl, ultimos_regs = historico_execucao[-1]
+            if estados:
+                ultimo_lbl, ultimos_regs = estados[-1]
                 self.texto_saida.insert(tk.END,
                                         f"\nFinal: ({ultimo_lbl}, ({', '.join(str(x) for x in ultimos_regs)}))\n")
             messagebox.showinfo("Execução", "Execução finalizada (veja saída).")
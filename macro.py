@@ -1,27 +1,100 @@
-from typing import List, Dict, Tuple, Any
+import json
+import os
+from typing import List, Dict, Tuple, Any, Optional
 from norma import nome_para_indice_registrador
+from instrumentacao import Instrumentacao
+
+
+# Quantidade de registradores (parâmetros) de cada macro, na ordem em que aparecem no comando
+PARAMETROS_MACRO = {'macro_igual': 3, 'macro_maior': 4, 'macro_menor': 3}
+# Arquivo de modelos gerado por superotimizador.py e lido pela interface: fica na mesma pasta dos módulos
+ARQUIVO_MODELOS_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'modelos_macros.json')
+# Tamanho da faixa de rótulos reservada para a expansão de cada macro (ver ExpansorMacro.iniciar_faixa)
+ROTULOS_POR_MACRO = 100
+
+
+"""
+Lê um arquivo JSON de modelos de macro (como o gerado por superotimizador.py) que substituem as expansões embutidas.
+Cada modelo é {'instrucoes': [...]} no mesmo formato relativo das funções expandir_*, mas com 'reg' indicando a 
+posição do parâmetro na macro (0 = primeiro registrador, 1 = segundo, ...). Um índice igual ao tamanho da lista 
+retorna para o programa principal.
+Modelos gerados com --somente-saida são recusados, porque só garantem o valor do registrador de saída.
+"""
+def carregar_modelos(caminho: str) -> Dict[str, List[Dict[str, Any]]]:
+    with open(caminho, 'r', encoding='utf-8') as f:
+        dados = json.load(f)
+
+    modelos = {}
+    for tipo, modelo in dados.items():
+        if tipo not in PARAMETROS_MACRO:
+            raise ValueError("Macro desconhecida no arquivo de modelos: " + str(tipo))
+        if modelo.get('somente_saida'):
+            # Só o registrador de saída foi verificado: os demais podem terminar diferentes da macro embutida
+            raise ValueError(f"Modelo de {tipo} gerado com --somente-saida não pode substituir a macro embutida")
+        instrs = modelo['instrucoes']
+        if not instrs:
+            raise ValueError(f"Modelo de {tipo} sem instruções")
+        if len(instrs) > ROTULOS_POR_MACRO:
+            raise ValueError(f"Modelo de {tipo} com mais de {ROTULOS_POR_MACRO} instruções")
+        for instr in instrs:
+            t = instr.get('tipo')
+            if t == 'ret':
+                continue
+            if t not in ('se_zero', 'adicionar', 'subtrair'):
+                raise ValueError(f"Instrução inválida no modelo de {tipo}: {instr}")
+            if not (0 <= instr['reg'] < PARAMETROS_MACRO[tipo]):
+                raise ValueError(f"Parâmetro inválido no modelo de {tipo}: {instr}")
+            indices = [instr['entao_idx'], instr['senao_idx']] if t == 'se_zero' else [instr['ir_idx']]
+            if any(not isinstance(i, int) or not (0 <= i <= len(instrs)) for i in indices):
+                raise ValueError(f"Desvio inválido no modelo de {tipo}: {instr}")
+        modelos[tipo] = instrs
+    return modelos
 
 
 """
 Classe usada para a tradução das macros para a linguagem da Máquina Norma
 """
 class ExpansorMacro:
-    def __init__(self, base_rotulo_inicio=100000):
+    def __init__(self, base_rotulo_inicio=100000, modelos: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+                 instrumentacao: Optional[Instrumentacao] = None):
+        self.base_rotulo_inicio = base_rotulo_inicio
         self.proximo_rotulo = base_rotulo_inicio - 1
+        self.modelos = modelos or {}    # Expansões carregadas com carregar_modelos, no lugar das embutidas
+        self.instrumentacao = instrumentacao    # Conta macros expandidas e rótulos gerados, se informada
 
     """ 
     Gera rótulos únicos e de alta numeração (100001, 100002, etc.) para as instruções que são criadas durante 
-    a expansão das macros. Isso evita dar conflito com os rótulos do programa principal
+    a expansão das macros. Isso evita dar conflito com os rótulos do programa principal (a interface usa 
+    iniciar_faixa, então a macro do rótulo 2 gera 100200, 100201, etc.)
     """
     def novo_rotulo(self) -> int:
         self.proximo_rotulo += 1
+        if self.instrumentacao is not None:
+            self.instrumentacao.incrementar('rotulos_gerados')
         return self.proximo_rotulo
 
+    """
+    Faz os próximos rótulos gerados saírem da faixa própria do rótulo do programa principal
+    (base + rotulo * ROTULOS_POR_MACRO em diante). Assim os rótulos da expansão de uma macro não dependem das macros
+    anteriores, e incluir ou remover uma macro não muda a numeração das outras.
+    """
+    def iniciar_faixa(self, rotulo: int):
+        self.proximo_rotulo = self.base_rotulo_inicio + rotulo * ROTULOS_POR_MACRO - 1
+
     """
     Expande uma macro para uma lista de instruções primitivas que a máquina norma conhece.
     """
     def expandir_macro(self, no: Tuple, num_regs: int) -> List[Dict[str, Any]]:
         tipo = no[0]
+        if self.instrumentacao is not None:
+            self.instrumentacao.incrementar('expansoes_macro')
+        if tipo in self.modelos:
+            regs = [nome_para_indice_registrador(r) for r in no[1:]]
+            # Os modelos só foram verificados com registradores distintos; se a chamada repete um registrador
+            # (ex.: MAIOR a b c a), usa a expansão embutida
+            if len(set(regs)) == len(regs):
+                return self.expandir_modelo(self.modelos[tipo], regs)
+
         if tipo == 'macro_igual':
             _, a, b, c = no
             ra = nome_para_indice_registrador(a)
@@ -46,6 +119,18 @@ class ExpansorMacro:
 
         raise ValueError("Macro desconhecida: " + str(tipo))
 
+    """
+    Instancia um modelo carregado de arquivo, trocando a posição do parâmetro pelo índice real do registrador.
+    """
+    def expandir_modelo(self, modelo: List[Dict[str, Any]], regs: List[int]) -> List[Dict[str, Any]]:
+        instrs = []
+        for instr in modelo:
+            instr = dict(instr)
+            if 'reg' in instr:
+                instr['reg'] = regs[instr['reg']]
+            instrs.append(instr)
+        return instrs
+
     def expandir_maior(self, r_a: int, r_b: int, r_c: int, r_d: int, num_regs: int) -> List[Dict[str, Any]]:
         """
         MACRO MAIOR:
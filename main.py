@@ -1,7 +1,21 @@
+import argparse
 import tkinter as tk
 from interface import AppNorma
+from instrumentacao import Instrumentacao
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Simulador da Máquina Norma")
+    parser.add_argument('--perfil-json', help="ao fechar, grava tempos das fases e contadores neste arquivo JSON")
+    parser.add_argument('--perfil-chrome', help="ao fechar, grava as fases no formato de eventos do Chrome")
+    args = parser.parse_args()
+
+    instrumentacao = Instrumentacao() if (args.perfil_json or args.perfil_chrome) else None
     root = tk.Tk()
-    app = AppNorma(root)
-    root.mainloop()
\ No newline at end of file
+    app = AppNorma(root, instrumentacao=instrumentacao)
+    root.mainloop()
+
+    if instrumentacao is not None:
+        if args.perfil_json:
+            instrumentacao.exportar_json(args.perfil_json)
+        if args.perfil_chrome:
+            instrumentacao.exportar_chrome_trace(args.perfil_chrome)
\ No newline at end of file
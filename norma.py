@@ -1,21 +1,31 @@
 import re
-from typing import Dict, Tuple, List, Any
+from typing import Dict, Tuple, List, Any, Optional
+from instrumentacao import Instrumentacao
 
 
 PADRAO_ROTULO = re.compile(r'^\s*([0-9]+)\s*:\s*(.+)$', re.IGNORECASE)   # Representa o rótulo, que é um numero seguido de :
 PADRAO_COMENTARIO = re.compile(r'#.*$')                                         # para ignorar os comentários
+REG = r'(r[0-9]+|[a-z]+)'                                                       # Nome de registrador: 'a', 'ab', 'r12'...
+PADRAO_NOME_REGISTRADOR = re.compile(REG)
 
 """
-Converte o nome do registrador 'a','b'... para o índice 0,1,...
+Converte o nome do registrador para o seu índice. São aceitos dois formatos:
+- letras, numeradas como colunas de planilha: 'a'..'z' -> 0..25, 'aa'..'az' -> 26..51, 'ba' -> 52, ...
+- 'r' seguido do índice: 'r0' -> 0, 'r25' -> 25, 'r9999' -> 9999 (por isso 'r0' e 'a' são o mesmo registrador)
 """
 def nome_para_indice_registrador(nome: str) -> int:
-    """Converte 'a'..'z' -> 0..25, valida nome."""
+    """Converte 'a'..'z', 'aa'.. ou 'r0'.. para o índice, valida nome."""
     if not isinstance(nome, str):
         raise ValueError("Nome de registrador deve ser string.")
     s = nome.strip().lower()
-    if len(s) != 1 or not ('a' <= s <= 'z'):
+    if PADRAO_NOME_REGISTRADOR.fullmatch(s) is None:
         raise ValueError(f"Nome de registrador inválido: '{nome}'")
-    return ord(s) - ord('a')
+    if s[0] == 'r' and s[1:].isdigit():
+        return int(s[1:])
+    indice = 0
+    for letra in s:
+        indice = indice * 26 + (ord(letra) - ord('a') + 1)
+    return indice - 1
 
 
 """
@@ -29,31 +39,31 @@ def analisar_instrucao_linha(texto_instr: str) -> Tuple:
         return ('vazio',)
 
     # Identifica a MACRO correspondente. Macros: IGUAL a b c | MAIOR a b c d | MENOR a b c
-    m = re.match(r'^(IGUAL)\s+([a-z])\s+([a-z])\s+([a-z])$', t, re.IGNORECASE)
+    m = re.match(rf'^(IGUAL)\s+{REG}\s+{REG}\s+{REG}$', t, re.IGNORECASE)
     if m:
         return ('macro_igual', m.group(2).lower(), m.group(3).lower(), m.group(4).lower())
 
-    m = re.match(r'^(MAIOR)\s+([a-z])\s+([a-z])\s+([a-z])\s+([a-z])$', t, re.IGNORECASE)
+    m = re.match(rf'^(MAIOR)\s+{REG}\s+{REG}\s+{REG}\s+{REG}$', t, re.IGNORECASE)
     if m:
         return ('macro_maior', m.group(2).lower(), m.group(3).lower(), m.group(4).lower(), m.group(5).lower())
 
-    m = re.match(r'^(MENOR)\s+([a-z])\s+([a-z])\s+([a-z])$', t, re.IGNORECASE)
+    m = re.match(rf'^(MENOR)\s+{REG}\s+{REG}\s+{REG}$', t, re.IGNORECASE)
     if m:
         return ('macro_menor', m.group(2).lower(), m.group(3).lower(), m.group(4).lower())
 
     # instruções primitivas
     # se zero_x então vá_para A senão vá_para B
-    m = re.match(r'^se\s+zero[_\s]?([a-z])\s+.*?([0-9]+)\s+.*?([0-9]+)$', t, re.IGNORECASE)
+    m = re.match(rf'^se\s+zero[_\s]?{REG}\s+.*?([0-9]+)\s+.*?([0-9]+)$', t, re.IGNORECASE)
     if m:
         return ('se_zero', m.group(1).lower(), int(m.group(2)), int(m.group(3)))
 
     # faça add_x vá_para N
-    m = re.match(r'^(?:fa(c|ç)a\s+)?(?:add|adicionar)[_\s]?([a-z])\s+.*?([0-9]+)$', t, re.IGNORECASE)
+    m = re.match(rf'^(?:fa(c|ç)a\s+)?(?:adicionar|add)[_\s]?{REG}\s+.*?([0-9]+)$', t, re.IGNORECASE)
     if m:
         return ('adicionar', m.group(2).lower(), int(m.group(3)))
 
     # faça sub_x vá_para N
-    m = re.match(r'^(?:fa(c|ç)a\s+)?(?:sub|subtrair)[_\s]?([a-z])\s+.*?([0-9]+)$', t, re.IGNORECASE)
+    m = re.match(rf'^(?:fa(c|ç)a\s+)?(?:subtrair|sub)[_\s]?{REG}\s+.*?([0-9]+)$', t, re.IGNORECASE)
     if m:
         return ('subtrair', m.group(2).lower(), int(m.group(3)))
 
@@ -61,38 +71,62 @@ def analisar_instrucao_linha(texto_instr: str) -> Tuple:
     raise ValueError(f"Instrução inválida ou não reconhecida: '{texto_instr}'")
 
 """
-    Esta função coordena a análise linha por linha. Ela lê todo o  programa, separa-o em linhas e, para cada linha, 
-    chama analisar_instrucao_linha. O resultado é um dicionário que mapeia cada rótulo do seu programa para sua 
-    representação estruturada.
+    Analisa uma linha completa do programa ('rotulo: instr'). Retorna None para linhas vazias ou de comentário e, 
+    caso contrário, a tupla (rotulo, instrução analisada). Como o resultado depende apenas do texto da linha, ele 
+    pode ser guardado em cache pelo editor e reaproveitado enquanto a linha não for alterada.
 """
-def analisar_texto_programa(texto: str) -> Dict[int, Tuple]:
-    linhas = texto.splitlines()
-    programa = {}
-    for raw in linhas:
-        linha = raw.strip()
-        if linha == '' or linha.startswith('#'):
-            continue
-        m = PADRAO_ROTULO.match(linha)
-        if not m:
-            raise ValueError(f"Linha com formato errado (esperado 'rotulo: instr'): '{linha}'")
-        rotulo = int(m.group(1))
-        instr = m.group(2).strip()
-        analisado = analisar_instrucao_linha(instr)     # Chama função para analisar a linha
-        programa[rotulo] = analisado
-    return programa
+def analisar_linha_programa(raw: str) -> Optional[Tuple[int, Tuple]]:
+    linha = raw.strip()
+    if linha == '' or linha.startswith('#'):
+        return None
+    m = PADRAO_ROTULO.match(linha)
+    if not m:
+        raise ValueError(f"Linha com formato errado (esperado 'rotulo: instr'): '{linha}'")
+    rotulo = int(m.group(1))
+    instr = m.group(2).strip()
+    analisado = analisar_instrucao_linha(instr)     # Chama função para analisar a linha
+    return rotulo, analisado
 
 
 """
 É uma das funções principais. Ela executa o programa expandido instrução por instrução, simulando o comportamento 
 da máquina Norma.
+Os registradores ficam em um dicionário esparso {índice: valor} que guarda apenas os registradores diferentes de 
+zero, então o custo de memória e de cada passo depende só dos registradores realmente usados. Pelo mesmo motivo o 
+traço não copia o estado inteiro a cada passo: cada entrada é (rótulo, alteração), onde alteração é o par 
+(registrador, novo valor) modificado pela instrução anterior ou None. Os valores iniciais devem ser naturais (>= 0). Use estados_do_traco para reconstruir os 
+estados completos. Se num_regs for informado, referências a registradores >= num_regs são tratadas como erro.
+Com uma instrumentação, mede a fase 'execucao', conta os passos e chama os callbacks de passo e de desvio dela.
 """
-def rodar_norma(programa: Dict[int, Dict], rotulo_inicial: int, regs: List[int], max_passos=100000) -> Tuple[
-    List[Tuple[int, Tuple[int, ...]]], str]:
+def rodar_norma(programa: Dict[int, Dict], rotulo_inicial: int, regs: Dict[int, int], max_passos=100000,
+                num_regs: Optional[int] = None, instrumentacao: Optional[Instrumentacao] = None) -> Tuple[
+    List[Tuple[int, Optional[Tuple[int, int]]]], str]:
+    if instrumentacao is None:
+        traco, erro, _ = _laco_norma(programa, rotulo_inicial, regs, max_passos, num_regs)
+        return traco, erro
+
+    with instrumentacao.fase('execucao'):
+        traco, erro, passos = _laco_norma(programa, rotulo_inicial, regs, max_passos, num_regs,
+                                          instrumentacao.ao_passo or None, instrumentacao.ao_desvio or None)
+    instrumentacao.incrementar('passos', passos)
+    return traco, erro
+
+
+"""
+Laço principal de rodar_norma (caminho crítico). Os callbacks de passo e de desvio chegam como None quando não há 
+nenhum registrado, e nesse caso custam só um teste local por passo. Retorna (traço, erro, instruções executadas).
+"""
+def _laco_norma(programa: Dict[int, Dict], rotulo_inicial: int, regs: Dict[int, int], max_passos: int,
+                num_regs: Optional[int], ao_passo: Optional[List] = None, ao_desvio: Optional[List] = None) -> Tuple[
+    List[Tuple[int, Optional[Tuple[int, int]]]], str, int]:
     traco = []              # Serve para armazenar o histórico de execução (trace) do programa.
     pc = rotulo_inicial     # Program counter (para indicar qual instrução deve ser executada)
     passos = 0
     erro = ''
+    alteracao = None        # Registrador alterado pela última instrução executada
     rotulos_validos = set(programa.keys())
+    for reg in [r for r, v in regs.items() if v == 0]:     # Registradores zerados não ficam no dicionário
+        del regs[reg]
 
     # Executa as instrções até o final do programa
     while True:
@@ -103,63 +137,99 @@ def rodar_norma(programa: Dict[int, Dict], rotulo_inicial: int, regs: List[int],
             break
 
         instr = programa[pc]                # pega a instrução atual
-        traco.append((pc, tuple(regs)))     # adicona o estado atual e os valores dos registradores
+        traco.append((pc, alteracao))       # adiciona o rótulo atual e o registrador alterado para chegar nele
+        alteracao = None
         t = instr.get('tipo')               # t armazena o tipo da instrução
+        if ao_passo is not None:
+            for funcao in ao_passo:
+                funcao(pc, instr, regs)
 
-        # se_zero: Checa o valor de um registrador. Se for zero, atualiza o pc para o rótulo de destino entao. Caso contrário, atualiza para o rótulo senao
-        if t == 'se_zero':
+        if t in ('se_zero', 'adicionar', 'subtrair'):
             reg = instr['reg']
-            if not (0 <= reg < len(regs)):
+            if reg < 0 or (num_regs is not None and reg >= num_regs):
                 erro = f"Referência a registrador inválido {reg} em label {pc}"
                 break
-            ent = instr['entao']
-            sen = instr['senao']
-            destino = ent if regs[reg] == 0 else sen
-            if destino not in rotulos_validos:
-                traco.append((destino, tuple(regs)))
-                break
-            pc = destino
+
+        # se_zero: Checa o valor de um registrador. Se for zero, atualiza o pc para o rótulo de destino entao. Caso contrário, atualiza para o rótulo senao
+        if t == 'se_zero':
+            destino = instr['senao'] if reg in regs else instr['entao']
+            if ao_desvio is not None:
+                for funcao in ao_desvio:
+                    funcao(pc, destino, reg not in regs)
 
         # adicionar: Incrementa o registrador e atualiza o pc para o rótulo de destino ir_para
         elif t == 'adicionar':
-            reg = instr['reg']
-            if not (0 <= reg < len(regs)):
-                erro = f"Referência a registrador inválido {reg} em label {pc}"
-                break
-            regs[reg] += 1
+            valor = regs.get(reg, 0) + 1
+            regs[reg] = valor
+            alteracao = (reg, valor)
             destino = instr['ir_para']
-            if destino not in rotulos_validos:
-                traco.append((destino, tuple(regs)))
-                break
-            pc = destino
 
-        # subtrair: decrementa o registrador e atualiza o pc para o rótulo de destino ir_para
+        # subtrair: decrementa o registrador (removendo-o do dicionário ao chegar em zero) e atualiza o pc para o rótulo de destino ir_para
         elif t == 'subtrair':
-            reg = instr['reg']
-            if not (0 <= reg < len(regs)):
-                erro = f"Referência a registrador inválido {reg} em label {pc}"
-                break
-            if regs[reg] > 0:
-                regs[reg] -= 1
+            valor = regs.get(reg, 0)
+            if valor > 1:
+                regs[reg] = valor - 1
+                alteracao = (reg, valor - 1)
+            elif valor == 1:
+                del regs[reg]
+                alteracao = (reg, 0)
             destino = instr['ir_para']
-            if destino not in rotulos_validos:
-                traco.append((destino, tuple(regs)))
-                break
-            pc = destino
 
         # ir_para: Apenas atualiza o pc para o rótulo de destino
         elif t == 'ir_para':
             destino = instr['ir_para']
-            if destino not in rotulos_validos:
-                traco.append((destino, tuple(regs)))
-                break
-            pc = destino
 
         # instruções desconhecidas
         else:
             erro = f"Instrução desconhecida no label {pc}: {instr}"
             break
 
-        passos += 1
+        passos += 1                         # conta só as instruções que foram de fato executadas
+        if destino not in rotulos_validos:
+            traco.append((destino, alteracao))
+            break
+        pc = destino
+
+    return traco, erro, passos
+
+
+"""
+Lista, em ordem, os registradores que aparecem na execução: os citados em alguma instrução do programa expandido, 
+os que começaram diferentes de zero e os alterados em algum passo do traço. O tamanho da lista depende só dos 
+registradores usados, não de N.
+"""
+def registradores_usados(programa: Dict[int, Dict], traco: List[Tuple[int, Optional[Tuple[int, int]]]],
+                         regs_iniciais: Dict[int, int]) -> List[int]:
+    usados = {instr['reg'] for instr in programa.values() if 'reg' in instr}
+    usados.update(reg for reg, valor in regs_iniciais.items() if valor != 0)
+    usados.update(alteracao[0] for _, alteracao in traco if alteracao is not None)
+    return sorted(usados)
+
+
+"""
+Converte o índice do registrador de volta para um nome, o inverso de nome_para_indice_registrador: 0..25 -> 'a'..'z'.
+A partir de 26 mostra as duas formas aceitas, o nome em letras e o 'rN': 26 -> 'aa/r26', 27 -> 'ab/r27', ...
+"""
+def indice_para_nome_registrador(indice: int) -> str:
+    letras = ''
+    n = indice + 1
+    while n > 0:
+        n, resto = divmod(n - 1, 26)
+        letras = chr(ord('a') + resto) + letras
+    return letras if indice < 26 else f"{letras}/r{indice}"
+
 
-    return traco, erro
\ No newline at end of file
+"""
+Reconstrói, a partir do traço produzido por rodar_norma, o estado dos registradores pedidos em cada passo.
+Recebe os valores iniciais (os mesmos passados para rodar_norma, antes da execução) e a lista de registradores a 
+mostrar (normalmente registradores_usados), e gera pares (rótulo, tupla de valores), um por entrada do traço. O 
+custo de cada passo depende só do tamanho dessa lista.
+"""
+def estados_do_traco(traco: List[Tuple[int, Optional[Tuple[int, int]]]], regs_iniciais: Dict[int, int],
+                     registradores: List[int]):
+    posicao = {reg: i for i, reg in enumerate(registradores)}
+    estado = [regs_iniciais.get(reg, 0) for reg in registradores]
+    for rotulo, alteracao in traco:
+        if alteracao is not None and alteracao[0] in posicao:
+            estado[posicao[alteracao[0]]] = alteracao[1]
+        yield rotulo, tuple(estado)
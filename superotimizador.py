@@ -0,0 +1,387 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+from typing import List, Dict, Tuple, Any, Optional
+from macro import ExpansorMacro, PARAMETROS_MACRO, ARQUIVO_MODELOS_PADRAO
+
+
+"""
+Superotimizador das macros (ferramenta offline).
+
+Procura, para cada macro, programas primitivos da máquina Norma que calculem a mesma coisa que a expansão embutida
+do ExpansorMacro gastando menos passos. A busca é estocástica: parte da expansão de referência e aplica mutações
+aleatórias (trocar registrador, desvio ou instrução, remover ou inserir instruções), aceitando as piores com uma
+probabilidade que diminui ao longo da busca (recozimento simulado). Um candidato só é aceito como melhor depois de
+ser verificado contra a referência em todo o domínio limitado de entradas; se falhar, a entrada que o derrubou
+entra no conjunto de testes da busca.
+
+Os candidatos são ordenados por (passos no pior caso, média de passos, número de instruções) e os melhores são
+gravados em JSON no formato lido por macro.carregar_modelos, que substitui as expansões embutidas.
+A verificação considera cada parâmetro da macro em um registrador próprio; chamadas que repetem um registrador
+(ex.: MAIOR a b c a) continuam usando a expansão embutida. Modelos gerados com --somente-saida são gravados só
+para consulta: carregar_modelos os recusa.
+
+Uso: python superotimizador.py (grava modelos_macros.json ao lado dos módulos, onde a interface o procura)
+"""
+
+
+PESO_ERRO = 1000    # Custo de cada caso de teste com resultado errado (ou que não termina)
+
+# Programas são listas de tuplas com desvios relativos ao bloco; um desvio igual ao tamanho da lista retorna:
+# ('se_zero', reg, entao, senao) | ('adicionar', reg, ir) | ('subtrair', reg, ir) | ('ret',)
+Programa = Tuple[Tuple, ...]
+
+
+"""
+Converte a expansão embutida de uma macro (com os parâmetros nas posições 0, 1, 2, ...) para a representação da busca
+"""
+def programa_referencia(tipo: str) -> Programa:
+    expansor = ExpansorMacro()
+    regs = list(range(PARAMETROS_MACRO[tipo]))
+    if tipo == 'macro_igual':
+        instrs = expansor.expandir_igual(*regs, len(regs))
+    elif tipo == 'macro_maior':
+        instrs = expansor.expandir_maior(*regs, len(regs))
+    elif tipo == 'macro_menor':
+        instrs = expansor.expandir_menor(*regs, len(regs))
+    else:
+        raise ValueError("Macro desconhecida: " + str(tipo))
+
+    programa = []
+    for instr in instrs:
+        if instr['tipo'] == 'se_zero':
+            programa.append(('se_zero', instr['reg'], instr['entao_idx'], instr['senao_idx']))
+        elif instr['tipo'] in ('adicionar', 'subtrair'):
+            programa.append((instr['tipo'], instr['reg'], instr['ir_idx']))
+        else:
+            programa.append(('ret',))
+    return tuple(programa)
+
+
+"""
+Converte um programa da busca para o formato de modelo aceito pelo ExpansorMacro
+"""
+def programa_para_modelo(programa: Programa) -> List[Dict[str, Any]]:
+    modelo = []
+    for instr in programa:
+        if instr[0] == 'se_zero':
+            modelo.append({'tipo': 'se_zero', 'reg': instr[1], 'entao_idx': instr[2], 'senao_idx': instr[3]})
+        elif instr[0] == 'ret':
+            modelo.append({'tipo': 'ret'})
+        else:
+            modelo.append({'tipo': instr[0], 'reg': instr[1], 'ir_idx': instr[2]})
+    return modelo
+
+
+"""
+Executa o bloco a partir do índice 0, contando os passos como rodar_norma conta (o 'ret' também é um passo).
+Retorna (registradores finais, passos) ou None se o limite de passos for atingido.
+"""
+def executar(programa: Programa, entrada: Tuple[int, ...], limite: int) -> Optional[Tuple[Tuple[int, ...], int]]:
+    regs = list(entrada)
+    n = len(programa)
+    pc = 0
+    passos = 0
+    while pc < n:
+        if passos >= limite:
+            return None
+        instr = programa[pc]
+        passos += 1
+        op = instr[0]
+        if op == 'se_zero':
+            pc = instr[2] if regs[instr[1]] == 0 else instr[3]
+        elif op == 'adicionar':
+            regs[instr[1]] += 1
+            pc = instr[2]
+        elif op == 'subtrair':
+            if regs[instr[1]] > 0:
+                regs[instr[1]] -= 1
+            pc = instr[2]
+        else:
+            break
+    return tuple(regs), passos
+
+
+"""
+Especificação de uma macro: as saídas e o número de passos da expansão de referência em cada entrada do domínio
+"""
+class Especificacao:
+    def __init__(self, tipo: str, limite_valor: int, somente_saida: bool):
+        self.tipo = tipo
+        self.referencia = programa_referencia(tipo)
+        k = PARAMETROS_MACRO[tipo]
+        # Registradores comparados: todos, ou apenas o de saída (último parâmetro da macro)
+        self.comparados = [k - 1] if somente_saida else list(range(k))
+        self.dominio = list(itertools.product(range(limite_valor + 1), repeat=k))
+        self.esperado = {}
+        for entrada in self.dominio:
+            saida, passos = executar(self.referencia, entrada, 10 ** 6)
+            self.esperado[entrada] = (self.observar(saida), passos)
+
+    def observar(self, regs: Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(regs[i] for i in self.comparados)
+
+    """
+    Avalia o programa nas entradas dadas. Retorna (erros, pior caso, média de passos). Cada execução pode gastar
+    no máximo o dobro dos passos da referência, já que candidatos mais lentos não interessam.
+    """
+    def avaliar(self, programa: Programa, entradas: List[Tuple[int, ...]]) -> Tuple[int, int, float]:
+        erros = 0
+        pior = 0
+        total = 0
+        for entrada in entradas:
+            saida_ref, passos_ref = self.esperado[entrada]
+            resultado = executar(programa, entrada, 2 * passos_ref + 10)
+            if resultado is None or self.observar(resultado[0]) != saida_ref:
+                erros += 1
+                continue
+            passos = resultado[1]
+            pior = max(pior, passos)
+            total += passos
+        return erros, pior, total / len(entradas)
+
+    """
+    Verifica o programa em todo o domínio. Retorna None se ele for equivalente à referência, ou uma entrada em que
+    o resultado difere.
+    """
+    def contraexemplo(self, programa: Programa) -> Optional[Tuple[int, ...]]:
+        for entrada in self.dominio:
+            saida_ref, passos_ref = self.esperado[entrada]
+            resultado = executar(programa, entrada, 2 * passos_ref + 10)
+            if resultado is None or self.observar(resultado[0]) != saida_ref:
+                return entrada
+        return None
+
+
+def destinos(instr: Tuple) -> Tuple[int, ...]:
+    return instr[2:] if instr[0] != 'ret' else ()
+
+
+def com_destinos(instr: Tuple, novos: List[int]) -> Tuple:
+    return instr[:2] + tuple(novos) if instr[0] != 'ret' else instr
+
+
+"""
+Remove as instruções inalcançáveis a partir do índice 0, renumerando os desvios
+"""
+def limpar(programa: List[Tuple]) -> List[Tuple]:
+    n = len(programa)
+    alcancaveis = set()
+    pilha = [0]
+    while pilha:
+        i = pilha.pop()
+        if i >= n or i in alcancaveis:
+            continue
+        alcancaveis.add(i)
+        pilha.extend(destinos(programa[i]))
+
+    novos_indices = {}
+    for i in sorted(alcancaveis):
+        novos_indices[i] = len(novos_indices)
+    novo_n = len(novos_indices)
+    return [com_destinos(programa[i], [novos_indices.get(d, novo_n) for d in destinos(programa[i])])
+            for i in sorted(alcancaveis)]
+
+
+"""
+Remove a instrução i, desviando quem apontava para ela ao seu sucessor (para se_zero, escolhe um dos ramos)
+"""
+def remover(programa: List[Tuple], i: int, rng: random.Random) -> Optional[List[Tuple]]:
+    instr = programa[i]
+    sucessor = rng.choice(destinos(instr)) if instr[0] != 'ret' else len(programa)
+    if sucessor == i:
+        return None
+
+    def renumerar(d):
+        if d == i:
+            d = sucessor
+        return d - 1 if d > i else d
+
+    return [com_destinos(instr, [renumerar(d) for d in destinos(instr)])
+            for j, instr in enumerate(programa) if j != i]
+
+
+"""
+Insere uma instrução aleatória antes da instrução i: quem desviava para i passa pela nova instrução
+"""
+def inserir(programa: List[Tuple], i: int, k: int, rng: random.Random) -> List[Tuple]:
+    novo = [com_destinos(instr, [d + 1 if d > i else d for d in destinos(instr)]) for instr in programa]
+    op = rng.choice(['se_zero', 'adicionar', 'subtrair'])
+    reg = rng.randrange(k)
+    if op == 'se_zero':
+        outro = rng.randrange(len(novo) + 2)
+        instr = ('se_zero', reg, i + 1, outro) if rng.random() < 0.5 else ('se_zero', reg, outro, i + 1)
+    else:
+        instr = (op, reg, i + 1)
+    novo.insert(i, instr)
+    return novo
+
+
+"""
+Aplica uma mutação aleatória ao programa. Retorna None quando a mutação sorteada não se aplica.
+"""
+def mutar(programa: Programa, k: int, rng: random.Random) -> Optional[Programa]:
+    novo = list(programa)
+    n = len(novo)
+    i = rng.randrange(n)
+    instr = novo[i]
+    escolha = rng.randrange(5)
+
+    if escolha == 0:        # troca o registrador
+        if instr[0] == 'ret':
+            return None
+        novo[i] = (instr[0], rng.randrange(k)) + instr[2:]
+    elif escolha == 1:      # troca um dos desvios
+        if instr[0] == 'ret':
+            return None
+        ds = list(destinos(instr))
+        ds[rng.randrange(len(ds))] = rng.randrange(n + 1)
+        novo[i] = com_destinos(instr, ds)
+    elif escolha == 2:      # troca a instrução, mantendo registrador e desvios
+        if instr[0] == 'ret':
+            return None
+        op = rng.choice([o for o in ('se_zero', 'adicionar', 'subtrair') if o != instr[0]])
+        ds = destinos(instr)
+        if op == 'se_zero':
+            novo[i] = (op, instr[1], ds[0], ds[-1])
+        else:
+            novo[i] = (op, instr[1], rng.choice(ds))
+    elif escolha == 3:
+        novo = remover(novo, i, rng)
+        if novo is None:
+            return None
+    else:
+        novo = inserir(novo, i, k, rng)
+
+    novo = limpar(novo)
+    if not novo:
+        return None
+    return tuple(novo)
+
+
+"""
+Chave de ordenação dos candidatos corretos: pior caso, média de passos e número de instruções
+"""
+def chave(avaliacao: Tuple[int, int, float], programa: Programa) -> Tuple[int, float, int]:
+    _, pior, media = avaliacao
+    return pior, media, len(programa)
+
+
+"""
+Busca por recozimento simulado a partir da referência. Retorna os candidatos verificados no domínio completo,
+do melhor para o pior, como pares (chave no domínio completo, programa).
+"""
+def otimizar(espec: Especificacao, iteracoes: int, limite_busca: int, rng: random.Random,
+             max_candidatos: int = 5) -> List[Tuple[Tuple[int, float, int], Programa]]:
+    k = PARAMETROS_MACRO[espec.tipo]
+    testes = [e for e in espec.dominio if max(e) <= limite_busca]
+
+    def custo(programa):
+        av = espec.avaliar(programa, testes)
+        return PESO_ERRO * av[0] + av[1] + av[2] + 0.5 * len(programa), av
+
+    atual = espec.referencia
+    custo_atual, _ = custo(atual)
+    verificados = {atual: chave(espec.avaliar(atual, espec.dominio), atual)}
+    melhor_busca = chave(espec.avaliar(atual, testes), atual)
+    temperatura_inicial = 10.0
+
+    for it in range(iteracoes):
+        temperatura = temperatura_inicial * (1 - it / iteracoes) + 0.05
+        candidato = mutar(atual, k, rng)
+        if candidato is None:
+            continue
+        c, av = custo(candidato)
+        if c <= custo_atual or rng.random() < math.exp((custo_atual - c) / temperatura):
+            atual, custo_atual = candidato, c
+
+        if av[0] == 0 and candidato not in verificados and chave(av, candidato) <= melhor_busca:
+            entrada = espec.contraexemplo(candidato)
+            if entrada is not None:
+                # O candidato só funcionava nos testes da busca: a entrada que o derrubou passa a ser testada
+                testes.append(entrada)
+                custo_atual, _ = custo(atual)
+                continue
+            melhor_busca = chave(av, candidato)
+            verificados[candidato] = chave(espec.avaliar(candidato, espec.dominio), candidato)
+
+    ranking = sorted(((ch, p) for p, ch in verificados.items()), key=lambda par: par[0])
+    return ranking[:max_candidatos]
+
+
+def formatar_programa(programa: Programa, nomes: str) -> str:
+    linhas = []
+    for i, instr in enumerate(programa):
+        if instr[0] == 'se_zero':
+            linhas.append(f"{i}: se zero_{nomes[instr[1]]} então vá_para {instr[2]} senão vá_para {instr[3]}")
+        elif instr[0] == 'adicionar':
+            linhas.append(f"{i}: faça add_{nomes[instr[1]]} vá_para {instr[2]}")
+        elif instr[0] == 'subtrair':
+            linhas.append(f"{i}: faça sub_{nomes[instr[1]]} vá_para {instr[2]}")
+        else:
+            linhas.append(f"{i}: ret")
+    linhas.append(f"{len(programa)}: # fim")
+    return "\n".join(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Procura expansões de macro com menos passos que as embutidas.")
+    parser.add_argument('--macros', nargs='+', default=sorted(PARAMETROS_MACRO), choices=sorted(PARAMETROS_MACRO))
+    parser.add_argument('--iteracoes', type=int, default=20000, help="mutações por macro")
+    parser.add_argument('--limite-busca', type=int, default=2, help="maior valor de registrador testado na busca")
+    parser.add_argument('--limite-verificacao', type=int, default=6,
+                        help="maior valor de registrador na verificação final")
+    parser.add_argument('--somente-saida', action='store_true',
+                        help="compara só o registrador de saída (os demais podem terminar com outros valores)")
+    parser.add_argument('--semente', type=int, default=0)
+    parser.add_argument('--saida', default=ARQUIVO_MODELOS_PADRAO,
+                        help="arquivo JSON com os modelos encontrados (padrão: o arquivo que a interface carrega)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.semente)
+    modelos = {}
+    for tipo in args.macros:
+        espec = Especificacao(tipo, args.limite_verificacao, args.somente_saida)
+        ref = chave(espec.avaliar(espec.referencia, espec.dominio), espec.referencia)
+        ranking = otimizar(espec, args.iteracoes, args.limite_busca, rng)
+
+        print(f"== {tipo} (entradas 0..{args.limite_verificacao}, {len(espec.dominio)} casos)")
+        print(f"   referência: pior caso {ref[0]} passos, média {ref[1]:.2f}, {ref[2]} instruções")
+        for pos, (ch, _) in enumerate(ranking, start=1):
+            print(f"   {pos}. pior caso {ch[0]} passos, média {ch[1]:.2f}, {ch[2]} instruções")
+
+        melhor_chave, melhor = ranking[0]
+        if melhor_chave >= ref:
+            print("   nenhuma expansão melhor que a embutida foi encontrada")
+            continue
+        print(f"   economia: {ref[0] - melhor_chave[0]} passos no pior caso, "
+              f"{ref[1] - melhor_chave[1]:.2f} em média ({100 * (1 - melhor_chave[1] / ref[1]):.1f}%)")
+        print(formatar_programa(melhor, 'abcd'))
+        modelos[tipo] = {
+            'instrucoes': programa_para_modelo(melhor),
+            'passos_pior_caso': melhor_chave[0],
+            'passos_media': round(melhor_chave[1], 3),
+            'referencia_pior_caso': ref[0],
+            'referencia_media': round(ref[1], 3),
+            'limite_verificacao': args.limite_verificacao,
+            'somente_saida': args.somente_saida,
+        }
+
+    if not modelos:
+        print(f"Nenhum modelo melhor encontrado; {args.saida} não foi alterado")
+        return
+
+    with open(args.saida, 'w', encoding='utf-8') as f:
+        json.dump(modelos, f, indent=2, ensure_ascii=False)
+    print(f"Modelos gravados em {os.path.abspath(args.saida)}")
+    if os.path.abspath(args.saida) != ARQUIVO_MODELOS_PADRAO:
+        print(f"Atenção: a interface só carrega {ARQUIVO_MODELOS_PADRAO}")
+    if args.somente_saida:
+        print("Atenção: modelos gerados com --somente-saida não são carregados pela interface (só para consulta)")
+
+
+if __name__ == '__main__':
+    main()